@@ -1,35 +1,37 @@
+import asyncio
+import functools
 import logging
 import os
-import json
+import re
+import string
+import time
+from collections import defaultdict
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 from livekit.agents import (
     Agent,
-    AgentSession,
     JobContext,
-    JobProcess,
-    MetricsCollectedEvent,
     RoomInputOptions,
+    RunContext,
     WorkerOptions,
     cli,
-    metrics,
-    tokenize,
     function_tool,
-    RunContext,
 )
-from livekit.plugins import murf, silero, google, deepgram, noise_cancellation
-from livekit.plugins.turn_detector.multilingual import MultilingualModel
+from livekit.plugins import noise_cancellation
+
+from voice_pipeline import build_session, prewarm, register_metrics
 
 logger = logging.getLogger("agent")
 load_dotenv(".env.local")
 
-DEFAULT_VOICE = "en-US-matthew"
-
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ORDERS_DIR = os.path.join(BASE_DIR, "orders")
-ORDERS_FILE = os.path.join(ORDERS_DIR, "day9_orders.json")
+ORDERS_FILE = os.path.join(ORDERS_DIR, "day9_orders.jsonl")
+LEGACY_ORDERS_FILE = os.path.join(ORDERS_DIR, "day9_orders.json")
 
 # -------------------------------------------------------------------
 #  CATALOG (in-code, ACP-style structure)
@@ -114,36 +116,81 @@ CATALOG: List[Dict[str, Any]] = [
     },
 ]
 
+# id -> product, so create_order does not scan the catalog.
+_PRODUCT_BY_ID: Dict[str, Dict[str, Any]] = {p["id"]: p for p in CATALOG}
+
 ORDERS: List[Dict[str, Any]] = []
 
+# Background persistence: a single writer task appends new orders off the
+# event loop; orders placed while it is writing are batched into its next pass.
+_persist_task: Optional["asyncio.Task[None]"] = None
+_pending_orders: List[Dict[str, Any]] = []
+_PERSIST_RETRIES = 3
+_PERSIST_RETRY_DELAY = 0.5  # seconds, multiplied by the attempt number
+
 
 # -------------------------------------------------------------------
 #  Helpers: load/save orders, normalize categories, filter products
 # -------------------------------------------------------------------
 
 def _ensure_orders_loaded() -> None:
-    """Load existing orders from JSON (if any) into ORDERS."""
+    """Load existing orders from JSON Lines (if any) into ORDERS."""
     global ORDERS
     try:
         # Ensure orders directory exists
         os.makedirs(ORDERS_DIR, exist_ok=True)
-        
+
+        if not os.path.exists(ORDERS_FILE) and os.path.exists(LEGACY_ORDERS_FILE):
+            # One-time migration from the old single JSON array file
+            with open(LEGACY_ORDERS_FILE, "rb") as f:
+                data = orjson.loads(f.read())
+            ORDERS = data if isinstance(data, list) else []
+            try:
+                _compact_orders(ORDERS)
+            except Exception:
+                # Keep serving the loaded orders; the legacy file is left in place
+                logger.warning("Could not migrate %s, keeping it", LEGACY_ORDERS_FILE)
+                return
+            logger.info(
+                "Migrated %d orders from %s to %s", len(ORDERS), LEGACY_ORDERS_FILE, ORDERS_FILE
+            )
+            return
+
         if not os.path.exists(ORDERS_FILE):
             logger.info("No existing orders file found at %s, starting fresh", ORDERS_FILE)
             ORDERS = []
             return
-            
-        with open(ORDERS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        if isinstance(data, list):
-            ORDERS = data
-            logger.info("Loaded %d existing orders from %s", len(ORDERS), ORDERS_FILE)
-        else:
-            logger.warning("Orders file contains invalid data, starting fresh")
-            ORDERS = []
-            
-    except json.JSONDecodeError:
+
+        orders: List[Dict[str, Any]] = []
+        skipped = 0
+        with open(ORDERS_FILE, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    order = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    skipped += 1
+                    continue
+                if isinstance(order, dict):
+                    orders.append(order)
+                else:
+                    skipped += 1
+
+        ORDERS = orders
+        logger.info("Loaded %d existing orders from %s", len(ORDERS), ORDERS_FILE)
+
+        # Drop torn or invalid lines (e.g. from a crash mid-append)
+        if skipped:
+            logger.warning("Skipped %d invalid lines in %s, compacting", skipped, ORDERS_FILE)
+            try:
+                _compact_orders(ORDERS)
+            except Exception:
+                # Compaction is only cleanup; _append_orders copes with a torn tail
+                logger.warning("Could not compact %s, keeping loaded orders", ORDERS_FILE)
+
+    except orjson.JSONDecodeError:
         logger.exception("Invalid JSON in orders file, starting fresh")
         ORDERS = []
     except Exception as e:
@@ -151,48 +198,216 @@ def _ensure_orders_loaded() -> None:
         ORDERS = []
 
 
-def _persist_orders() -> None:
-    """Write ORDERS list to JSON atomically."""
+def _dump_order(order: Dict[str, Any]) -> bytes:
+    """Serialize one order as a compact UTF-8 JSON line."""
+    return orjson.dumps(order, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _append_orders(orders: List[Dict[str, Any]]) -> None:
+    """Append orders to the JSON Lines file, one order per line (blocking)."""
+    try:
+        os.makedirs(ORDERS_DIR, exist_ok=True)
+        lines = b"".join(_dump_order(o) for o in orders)
+        with open(ORDERS_FILE, "a+b", buffering=0) as f:
+            start = f.seek(0, os.SEEK_END)
+            if start:
+                f.seek(start - 1)
+                # Start on a fresh line if an earlier write was torn
+                if f.read(1) != b"\n":
+                    lines = b"\n" + lines
+            try:
+                view = memoryview(lines)
+                while view:
+                    view = view[f.write(view):]
+            except Exception:
+                # Roll back a partial write so a retry neither glues onto nor
+                # duplicates what made it to disk
+                f.truncate(start)
+                raise
+        logger.info("Appended %d orders to %s", len(orders), ORDERS_FILE)
+    except Exception as e:
+        logger.error("Failed to persist orders: %s", str(e))
+        raise
+
+
+def _compact_orders(orders: List[Dict[str, Any]]) -> None:
+    """Rewrite the whole JSON Lines file atomically (blocking)."""
     try:
         os.makedirs(ORDERS_DIR, exist_ok=True)
         tmp = ORDERS_FILE + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(ORDERS, f, indent=2, ensure_ascii=False, default=str)
+        with open(tmp, "wb") as f:
+            f.writelines(_dump_order(o) for o in orders)
         os.replace(tmp, ORDERS_FILE)
-        logger.info("Persisted %d orders to %s", len(ORDERS), ORDERS_FILE)
+        logger.info("Compacted %d orders into %s", len(orders), ORDERS_FILE)
     except Exception as e:
-        logger.error("Failed to persist orders: %s", str(e))
+        logger.error("Failed to compact orders: %s", str(e))
         raise
 
 
-def _normalize_category(raw: Optional[str]) -> Optional[str]:
+async def _flush_orders() -> None:
+    """
+    Append pending orders in a worker thread until none are left.
+
+    A failed batch goes back to the front of the queue and is retried a few
+    times; after that it stays queued for the next order or for shutdown.
+    """
+    global _pending_orders
+    failures = 0
+    while _pending_orders:
+        batch, _pending_orders = _pending_orders, []
+        try:
+            await asyncio.to_thread(_append_orders, batch)
+            failures = 0
+        except Exception:
+            _pending_orders = batch + _pending_orders
+            failures += 1
+            if failures >= _PERSIST_RETRIES:
+                logger.exception(
+                    "Order flush failed %d times, keeping %d orders queued",
+                    failures,
+                    len(_pending_orders),
+                )
+                return
+            logger.warning("Order flush failed (attempt %d), retrying", failures)
+            await asyncio.sleep(_PERSIST_RETRY_DELAY * failures)
+
+
+def _schedule_persist(order: Dict[str, Any]) -> None:
+    """Queue a new order for appending and make sure a writer task is running."""
+    global _persist_task
+    _pending_orders.append(order)
+    if _persist_task is None or _persist_task.done():
+        _persist_task = asyncio.create_task(_flush_orders())
+
+
+async def _wait_for_pending_persist() -> None:
+    """Let an in-flight flush finish, then retry anything still queued (used on shutdown)."""
+    if _persist_task is not None and not _persist_task.done():
+        await _persist_task
+    if _pending_orders:
+        await _flush_orders()
+    if _pending_orders:
+        logger.error(
+            "Could not persist %d orders: %s",
+            len(_pending_orders),
+            [o.get("id") for o in _pending_orders],
+        )
+
+
+_CAT_MAP: Dict[str, str] = {
+    "mug": "mug",
+    "coffee": "mug",
+    "coffeemug": "mug",
+    "cup": "mug",
+    "tshirt": "tshirt",
+    "tee": "tshirt",
+    "shirt": "tshirt",
+    "hoodie": "hoodie",
+    "hood": "hoodie",
+    "sweatshirt": "hoodie",
+    "jumper": "hoodie",
+    "accessory": "accessory",
+    "cap": "accessory",
+    "hat": "accessory",
+    "bag": "accessory",
+    "tote": "accessory",
+}
+
+# Lowercases and drops "-" / " " in a single str.translate pass.
+_CAT_TRANS = str.maketrans(string.ascii_uppercase, string.ascii_lowercase, "- ")
+
+
+@functools.lru_cache(maxsize=256)
+def _normalize_category(raw: str) -> str:
     """Map 'hoodies', 't-shirts', 'tees', 'mugs', etc. into stable keys."""
-    if not raw:
-        return None
-    s = raw.strip().lower()
-    s = s.replace("-", "").replace(" ", "")
+    s = raw.translate(_CAT_TRANS).strip()
     if s.endswith("s"):
         s = s[:-1]
+    return _CAT_MAP.get(s, s)
 
-    mapping = {
-        "mug": "mug",
-        "coffee": "mug",
-        "coffeemug": "mug",
-        "cup": "mug",
-        "tshirt": "tshirt",
-        "tee": "tshirt",
-        "shirt": "tshirt",
-        "hoodie": "hoodie",
-        "hood": "hoodie",
-        "sweatshirt": "hoodie",
-        "jumper": "hoodie",
-        "accessory": "accessory",
-        "cap": "accessory",
-        "hat": "accessory",
-        "bag": "accessory",
-        "tote": "accessory",
-    }
-    return mapping.get(s, s)
+
+# Per-product search fields, normalized once at import and kept parallel to
+# CATALOG so the product dicts returned by tools stay clean.
+_CAT_NORM: List[Optional[str]] = [
+    _normalize_category(p["category"]) if p.get("category") else None for p in CATALOG
+]
+_COLOR_TOKENS: List[FrozenSet[str]] = [
+    frozenset(str(p.get("color", "")).lower().split()) for p in CATALOG
+]
+_BLOB_LC: List[str] = [
+    (p.get("name", "") + " " + p.get("description", "")).lower() for p in CATALOG
+]
+
+# Column arrays for the structured filters, so price/category/color become
+# vectorized boolean masks instead of a per-product Python loop.
+_PRICES = np.asarray([p.get("price", 0) for p in CATALOG], dtype=np.int64)
+_CAT_TO_ID: Dict[str, int] = {c: i for i, c in enumerate(sorted({c for c in _CAT_NORM if c}))}
+_CAT_IDS = np.asarray([_CAT_TO_ID[c] if c else -1 for c in _CAT_NORM], dtype=np.int16)
+_COLOR_MASKS: Dict[str, np.ndarray] = {}
+for _i, _colors in enumerate(_COLOR_TOKENS):
+    for _color in _colors:
+        _COLOR_MASKS.setdefault(_color, np.zeros(len(CATALOG), dtype=bool))[_i] = True
+
+# Inverted index over name+description words: token -> catalog positions.
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_TEXT_INDEX: Dict[str, Set[int]] = defaultdict(set)
+for _i, _blob in enumerate(_BLOB_LC):
+    for _tok in _TOKEN_RE.findall(_blob):
+        _TEXT_INDEX[_tok].add(_i)
+
+
+def _text_shortlist(text_norm: str) -> Optional[List[int]]:
+    """
+    Catalog positions worth checking for text_norm, or None to scan everything.
+
+    Only the inner words of a phrase are guaranteed to appear whole in a
+    matching blob (the first/last may be partial, e.g. "off" in "coffee"), so
+    only those narrow the set before the substring check. A single word is
+    both first and last, so it always scans.
+    """
+    tokens = _TOKEN_RE.findall(text_norm)
+    shortlist: Optional[Set[int]] = None
+    for tok in tokens[1:-1]:
+        hits = _TEXT_INDEX.get(tok, set())
+        shortlist = hits if shortlist is None else shortlist & hits
+    return sorted(shortlist) if shortlist is not None else None
+
+
+@functools.lru_cache(maxsize=128)
+def _match_positions(
+    cat_norm: Optional[str],
+    max_price: Optional[int],
+    color_norm: Optional[str],
+    text_norm: Optional[str],
+) -> Tuple[int, ...]:
+    """Catalog positions matching already-normalized filters (cached per query)."""
+    mask = np.ones(len(CATALOG), dtype=bool)
+
+    # max price is hard filter
+    if max_price is not None:
+        mask &= np.less_equal(_PRICES, max_price)
+
+    if cat_norm:
+        if cat_norm not in _CAT_TO_ID:
+            return ()
+        mask &= np.equal(_CAT_IDS, _CAT_TO_ID[cat_norm])
+
+    if color_norm:
+        if color_norm not in _COLOR_MASKS:
+            return ()
+        mask &= _COLOR_MASKS[color_norm]
+
+    if not text_norm:
+        return tuple(int(i) for i in np.flatnonzero(mask))
+
+    # Text stays a per-item substring check, limited to the index shortlist.
+    shortlist = _text_shortlist(text_norm)
+    if shortlist is not None:
+        text_mask = np.zeros(len(CATALOG), dtype=bool)
+        text_mask[shortlist] = True
+        mask &= text_mask
+
+    return tuple(int(i) for i in np.flatnonzero(mask) if text_norm in _BLOB_LC[i])
 
 
 def _filter_products(
@@ -206,36 +421,21 @@ def _filter_products(
       - category / color are normalized and treated as soft filters.
       - text_query checks name+description.
       - if filters yield 0, we fall back to full catalog.
+
+    The returned list may be CATALOG itself; callers must not mutate it.
     """
-    cat_norm = _normalize_category(category)
+    cat_norm = _normalize_category(category) if category else None
     color_norm = color.strip().lower() if color else None
     text_norm = text_query.strip().lower() if text_query else None
 
-    results: List[Dict[str, Any]] = []
-
-    for p in CATALOG:
-        # max price is hard filter
-        if max_price is not None and p.get("price", 0) > max_price:
-            continue
-
-        pc = _normalize_category(p.get("category"))
-        if cat_norm and pc != cat_norm:
-            continue
-
-        if color_norm:
-            pc_color = str(p.get("color", "")).lower()
-            if color_norm not in pc_color:
-                continue
-
-        if text_norm:
-            blob = (p.get("name", "") + " " + p.get("description", "")).lower()
-            if text_norm not in blob:
-                continue
+    # No filters means return all
+    if not (cat_norm or max_price is not None or color_norm or text_norm):
+        return CATALOG
 
-        results.append(p)
+    positions = _match_positions(cat_norm, max_price, color_norm, text_norm)
 
     # If filters applied but nothing found, fall back to entire catalog
-    if not results and (cat_norm or max_price is not None or color_norm or text_norm):
+    if not positions:
         logger.info(
             "Filters matched no products (category=%r, max_price=%r, color=%r, text=%r). "
             "Falling back to full catalog.",
@@ -244,20 +444,13 @@ def _filter_products(
             color_norm,
             text_norm,
         )
-        return CATALOG.copy()
-
-    # No filters means return all
-    if not results and not (cat_norm or max_price is not None or color_norm or text_norm):
-        return CATALOG.copy()
+        return CATALOG
 
-    return results
+    return [CATALOG[i] for i in positions]
 
 
 def _find_product_by_id(pid: str) -> Optional[Dict[str, Any]]:
-    for p in CATALOG:
-        if p.get("id") == pid:
-            return p
-    return None
+    return _PRODUCT_BY_ID.get(pid)
 
 
 # -------------------------------------------------------------------
@@ -403,7 +596,10 @@ STYLE:
             return {"ok": False, "error": f"Unknown product id {product_id!r}"}
 
         quantity = max(1, quantity)
-        order_id = f"ORD-{int(datetime.now(timezone.utc).timestamp())}"
+        # one clock read; id and created_at share the same whole second
+        sec, ns = divmod(time.time_ns(), 10**9)
+        now = datetime.fromtimestamp(sec, tz=timezone.utc).replace(microsecond=ns // 1000)
+        order_id = f"ORD-{sec}"
         line_total = product["price"] * quantity
 
         item: Dict[str, Any] = {
@@ -420,11 +616,11 @@ STYLE:
             "items": [item],
             "total": line_total,
             "currency": product.get("currency", "INR"),
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": now.isoformat(),
         }
 
         ORDERS.append(order)
-        _persist_orders()
+        _schedule_persist(order)
 
         logger.info(
             "Created order %s for product %s x%d (size=%r, total=%d)",
@@ -451,40 +647,14 @@ STYLE:
 #  LiveKit wiring
 # -------------------------------------------------------------------
 
-def prewarm(proc: JobProcess):
-    proc.userdata["vad"] = silero.VAD.load()
-
-
 async def entrypoint(ctx: JobContext):
     ctx.log_context_fields = {"room": ctx.room.name}
 
     agent = CommerceAgent()
+    session = await build_session(ctx.proc)
 
-    session = AgentSession(
-        stt=deepgram.STT(model="nova-3"),
-        llm=google.LLM(model="gemini-2.5-flash"),
-        tts=murf.TTS(
-            voice=DEFAULT_VOICE,
-            tokenizer=tokenize.basic.SentenceTokenizer(min_sentence_len=2),
-            text_pacing=True,
-        ),
-        turn_detection=MultilingualModel(),
-        vad=ctx.proc.userdata["vad"],
-        preemptive_generation=True,
-    )
-
-    usage_collector = metrics.UsageCollector()
-
-    @session.on("metrics_collected")
-    def _on_metrics(ev: MetricsCollectedEvent):
-        metrics.log_metrics(ev.metrics)
-        usage_collector.collect(ev.metrics)
-
-    async def log_usage():
-        summary = usage_collector.get_summary()
-        logger.info(f"Usage: {summary}")
-
-    ctx.add_shutdown_callback(log_usage)
+    register_metrics(session, ctx)
+    ctx.add_shutdown_callback(_wait_for_pending_persist)
 
     await session.start(
         agent=agent,
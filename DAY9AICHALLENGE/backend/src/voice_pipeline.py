@@ -0,0 +1,106 @@
+"""
+Voice pipeline - STT/LLM/TTS session setup for the Day 9 shopping agent
+
+Plugin configuration, VAD prewarm and metrics wiring, split out of agent.py
+so that it only deals with the catalog, orders and tools.
+"""
+
+import asyncio
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from livekit.agents import (
+    AgentSession,
+    JobContext,
+    JobProcess,
+    MetricsCollectedEvent,
+    metrics,
+)
+from livekit.agents import tokenize as lk_tokenize
+from livekit.plugins import deepgram, google, murf, silero
+from livekit.plugins.turn_detector.multilingual import MultilingualModel
+
+logger = logging.getLogger("agent")
+
+DEFAULT_VOICE = "en-US-matthew"
+
+_CLAUSE_BREAK_RE = re.compile(r"(?<=[,;:])\s+")
+
+
+class ClauseTokenizer(lk_tokenize.SentenceTokenizer):
+    """
+    Sentence tokenizer that also breaks on , ; : so the first clause of a
+    reply reaches TTS without waiting for the end of the sentence.
+    """
+
+    def __init__(self, *, min_clause_len: int = 1, stream_context_len: int = 10) -> None:
+        self._sentences = lk_tokenize.basic.SentenceTokenizer(min_sentence_len=min_clause_len)
+        self._min_clause_len = min_clause_len
+        self._stream_context_len = stream_context_len
+
+    def tokenize(self, text: str, *, language: Optional[str] = None) -> List[str]:
+        return [
+            clause
+            for sentence in self._sentences.tokenize(text)
+            for clause in _CLAUSE_BREAK_RE.split(sentence)
+            if clause
+        ]
+
+    def stream(self, *, language: Optional[str] = None) -> lk_tokenize.SentenceStream:
+        return lk_tokenize.BufferedSentenceStream(
+            tokenizer=self.tokenize,
+            min_token_len=self._min_clause_len,
+            min_ctx_len=self._stream_context_len,
+        )
+
+
+def prewarm(proc: JobProcess):
+    # Load Silero VAD on a worker thread so prewarm returns right away;
+    # build_session picks up the result once the other plugins are built.
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vad-load")
+    proc.userdata["vad_fut"] = executor.submit(silero.VAD.load)
+    executor.shutdown(wait=False)
+
+
+async def _load_vad(proc: JobProcess) -> silero.VAD:
+    """Wait for the VAD started in prewarm (cached for later jobs)."""
+    if "vad" not in proc.userdata:
+        proc.userdata["vad"] = await asyncio.wrap_future(proc.userdata["vad_fut"])
+    return proc.userdata["vad"]
+
+
+async def build_session(proc: JobProcess) -> AgentSession:
+    """Create the Deepgram + Gemini + Murf session for this job."""
+    return AgentSession(
+        stt=deepgram.STT(model="nova-3"),
+        llm=google.LLM(model="gemini-2.5-flash"),
+        tts=murf.TTS(
+            voice=DEFAULT_VOICE,
+            tokenizer=ClauseTokenizer(min_clause_len=1),
+            text_pacing=True,
+        ),
+        turn_detection=MultilingualModel(),
+        # evaluated after the plugins above, so their setup overlaps the load
+        vad=await _load_vad(proc),
+        preemptive_generation=True,
+        # the turn detector still extends the wait when the user seems mid-thought
+        min_endpointing_delay=0.05,
+    )
+
+
+def register_metrics(session: AgentSession, ctx: JobContext) -> None:
+    """Log per-turn metrics and a usage summary on shutdown."""
+    usage_collector = metrics.UsageCollector()
+
+    @session.on("metrics_collected")
+    def _on_metrics(ev: MetricsCollectedEvent):
+        metrics.log_metrics(ev.metrics)
+        usage_collector.collect(ev.metrics)
+
+    async def log_usage():
+        summary = usage_collector.get_summary()
+        logger.info(f"Usage: {summary}")
+
+    ctx.add_shutdown_callback(log_usage)
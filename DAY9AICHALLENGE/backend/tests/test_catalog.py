@@ -0,0 +1,39 @@
+import pytest
+
+from agent import _BLOB_LC, _TEXT_INDEX, CATALOG, _filter_products
+
+
+def _substring_scan(text: str) -> list:
+    """The original text filter: plain substring over name+description."""
+    text = text.strip().lower()
+    return [p for p, blob in zip(CATALOG, _BLOB_LC) if text in blob] or CATALOG
+
+
+def _phrases() -> list:
+    """Every 2-4 word window of every blob, plus windows with clipped edges."""
+    phrases = set()
+    for blob in _BLOB_LC:
+        words = blob.split()
+        for n in (2, 3, 4):
+            for i in range(len(words) - n + 1):
+                phrase = " ".join(words[i : i + n])
+                phrases.add(phrase)
+                phrases.add(phrase[1:-1])
+    return sorted(p for p in phrases if p.strip())
+
+
+@pytest.mark.parametrize("token", sorted(_TEXT_INDEX))
+def test_single_word_matches_substring_scan(token: str) -> None:
+    """Indexed words must still match inside longer words ("off" in "coffee")."""
+    assert _filter_products(text_query=token) == _substring_scan(token)
+
+
+@pytest.mark.parametrize("phrase", _phrases())
+def test_phrase_matches_substring_scan(phrase: str) -> None:
+    """The inner-word shortlist must never drop a substring match."""
+    assert _filter_products(text_query=phrase) == _substring_scan(phrase)
+
+
+@pytest.mark.parametrize("text", ["off", "t", "a", "shirt", "hood", "xyz"])
+def test_partial_words(text: str) -> None:
+    assert _filter_products(text_query=text) == _substring_scan(text)
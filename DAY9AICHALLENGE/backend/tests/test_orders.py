@@ -0,0 +1,130 @@
+import orjson
+import pytest
+
+import agent
+from agent import CATALOG, CommerceAgent
+
+
+@pytest.fixture
+def orders_dir(tmp_path, monkeypatch):
+    """Point order persistence at a temp dir and reset the writer state."""
+    monkeypatch.setattr(agent, "ORDERS_DIR", str(tmp_path))
+    monkeypatch.setattr(agent, "ORDERS_FILE", str(tmp_path / "day9_orders.jsonl"))
+    monkeypatch.setattr(agent, "LEGACY_ORDERS_FILE", str(tmp_path / "day9_orders.json"))
+    monkeypatch.setattr(agent, "ORDERS", [])
+    monkeypatch.setattr(agent, "_pending_orders", [])
+    monkeypatch.setattr(agent, "_persist_task", None)
+    monkeypatch.setattr(agent, "_PERSIST_RETRY_DELAY", 0)
+    return tmp_path
+
+
+def _saved_orders(path) -> list:
+    return [orjson.loads(line) for line in path.read_bytes().splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_orders_are_appended_one_per_line(orders_dir) -> None:
+    shop = CommerceAgent()
+    await shop.create_order(None, product_id=CATALOG[0]["id"])
+    await shop.create_order(None, product_id=CATALOG[1]["id"], quantity=2)
+    await agent._wait_for_pending_persist()
+
+    saved = _saved_orders(orders_dir / "day9_orders.jsonl")
+    assert [o["items"][0]["product_id"] for o in saved] == [
+        CATALOG[0]["id"],
+        CATALOG[1]["id"],
+    ]
+    assert saved == agent.ORDERS
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(orders_dir, monkeypatch) -> None:
+    append = agent._append_orders
+    calls = []
+
+    def flaky_append(orders):
+        calls.append(list(orders))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        append(orders)
+
+    monkeypatch.setattr(agent, "_append_orders", flaky_append)
+    order = {"id": "ORD-1"}
+    agent._schedule_persist(order)
+    await agent._wait_for_pending_persist()
+
+    assert calls == [[order], [order]]
+    assert _saved_orders(orders_dir / "day9_orders.jsonl") == [order]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_stays_queued_until_next_flush(
+    orders_dir, monkeypatch
+) -> None:
+    append = agent._append_orders
+
+    def failing_append(orders):
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(agent, "_append_orders", failing_append)
+    first, second = {"id": "ORD-1"}, {"id": "ORD-2"}
+    agent._schedule_persist(first)
+    agent._schedule_persist(second)
+    await agent._wait_for_pending_persist()
+
+    assert agent._pending_orders == [first, second]
+    assert not (orders_dir / "day9_orders.jsonl").exists()
+
+    monkeypatch.setattr(agent, "_append_orders", append)
+    await agent._wait_for_pending_persist()
+
+    assert agent._pending_orders == []
+    assert _saved_orders(orders_dir / "day9_orders.jsonl") == [first, second]
+
+
+def test_append_after_torn_line_starts_a_new_line(orders_dir) -> None:
+    path = orders_dir / "day9_orders.jsonl"
+    path.write_bytes(b'{"id":"ORD-1"}\n{"id":"ORD-2","ite')
+
+    agent._append_orders([{"id": "ORD-3"}])
+
+    assert path.read_bytes().endswith(b'"ite\n{"id":"ORD-3"}\n')
+    agent._ensure_orders_loaded()
+    assert [o["id"] for o in agent.ORDERS] == ["ORD-1", "ORD-3"]
+
+
+def test_legacy_json_array_is_migrated(orders_dir) -> None:
+    legacy = [{"id": "ORD-1"}, {"id": "ORD-2"}]
+    (orders_dir / "day9_orders.json").write_bytes(orjson.dumps(legacy))
+
+    agent._ensure_orders_loaded()
+
+    assert legacy == agent.ORDERS
+    assert _saved_orders(orders_dir / "day9_orders.jsonl") == legacy
+
+
+def test_failed_compaction_keeps_loaded_orders(orders_dir, monkeypatch) -> None:
+    path = orders_dir / "day9_orders.jsonl"
+    path.write_bytes(b'{"id":"ORD-1"}\n{"id":"ORD-2"}\n{"id":"ORD-3","ite')
+
+    def failing_compact(orders):
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(agent, "_compact_orders", failing_compact)
+    agent._ensure_orders_loaded()
+
+    assert [o["id"] for o in agent.ORDERS] == ["ORD-1", "ORD-2"]
+
+
+def test_failed_migration_keeps_loaded_orders(orders_dir, monkeypatch) -> None:
+    legacy = [{"id": "ORD-1"}, {"id": "ORD-2"}]
+    (orders_dir / "day9_orders.json").write_bytes(orjson.dumps(legacy))
+
+    def failing_compact(orders):
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(agent, "_compact_orders", failing_compact)
+    agent._ensure_orders_loaded()
+
+    assert legacy == agent.ORDERS
+    assert (orders_dir / "day9_orders.json").exists()
@@ -1,4 +1,5 @@
 # src/agent.py
+import asyncio
 import logging
 import json
 import os
@@ -279,14 +280,15 @@ async def complete_checkin(ctx: RunContext[Userdata]):
         summary=summary
     )
 
+    # File write and Todoist HTTP calls block, so keep them off the event loop
     try:
-        save_entry(entry)
+        await asyncio.to_thread(save_entry, entry)
     except Exception as e:
         print(f"❌ complete_checkin: failed to save entry: {e}")
         return "I recorded the check-in in memory, but I couldn't save it to disk."
 
     # Push to Todoist (Option A: automatic)
-    todoist_result = push_checkin_to_todoist(entry)
+    todoist_result = await asyncio.to_thread(push_checkin_to_todoist, entry)
 
     # Generate original advice
     advice = generate_original_advice(w.mood, w.energy, w.stress, w.goals)
@@ -379,6 +381,7 @@ async def entrypoint(ctx: JobContext):
         ),
         turn_detection=MultilingualModel(),
         vad=ctx.proc.userdata.get("vad"),
+        min_endpointing_delay=0.05,
         userdata=userdata
     )
 